@@ -4,11 +4,16 @@ from werkzeug.utils import secure_filename
 import os
 import traceback
 from ultralytics import YOLO
+from utils.detections import PRIMARY_MODEL_PATH, parse_results
+from utils.shadow_eval import create_shadow_evaluator
 
 predict_bp = Blueprint('predict', __name__)
 
 # Load model
-model = YOLO('ml_model/best.pt')
+model = YOLO(PRIMARY_MODEL_PATH)
+
+# Optional candidate model evaluated on a sample of live traffic
+shadow_evaluator = create_shadow_evaluator()
 
 UPLOAD_FOLDER = 'uploads'
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
@@ -52,17 +57,13 @@ def upload_image():
         file.save(filepath)
         
         # Run prediction
-        results = model(filepath)
+        results = shadow_evaluator.run_primary(model, filepath)
         
         # Parse results
-        predictions = []
-        for result in results:
-            for box in result.boxes:
-                predictions.append({
-                    'class': result.names[int(box.cls[0])],
-                    'confidence': float(box.conf[0]),
-                    'bbox': box.xyxy[0].tolist()
-                })
+        predictions = parse_results(results)
+        
+        # Mirror to the candidate model in the background (never blocks the response)
+        shadow_evaluator.maybe_submit(filepath, predictions)
         
         return jsonify({
             'success': True,
@@ -120,3 +121,27 @@ def get_stats():
     except Exception as e:
         print(f"Stats error: {traceback.format_exc()}")
         return jsonify({'error': str(e)}), 500
+
+@predict_bp.route('/shadow/stats', methods=['GET'])
+def get_shadow_stats():
+    """Get per-version latency, memory and agreement stats for shadow evaluation"""
+    try:
+        auth_header = request.headers.get('Authorization')
+        if not auth_header:
+            return jsonify({'error': 'No authorization token'}), 401
+        
+        token = auth_header.split('Bearer ')[-1] if 'Bearer' in auth_header else auth_header
+        decoded_token = verify_token(token)
+        
+        if not decoded_token:
+            return jsonify({'error': 'Invalid token'}), 401
+        
+        # Model rollout details are for operators only, not patients
+        if decoded_token.get('admin') is not True:
+            return jsonify({'error': 'Admin access required'}), 403
+        
+        return jsonify(shadow_evaluator.get_stats()), 200
+        
+    except Exception as e:
+        print(f"Shadow stats error: {traceback.format_exc()}")
+        return jsonify({'error': str(e)}), 500
@@ -0,0 +1,295 @@
+import glob
+import os
+import tempfile
+import threading
+import time
+
+import pytest
+
+from utils import shadow_eval
+from utils.shadow_eval import MAX_PENDING_JOBS, MemoryProbe, ShadowEvaluator, VersionStats, create_shadow_evaluator
+
+
+class FakeBox:
+    def __init__(self, class_id, confidence):
+        self.cls = [class_id]
+        self.conf = [confidence]
+        self.xyxy = [FakeTensor([0.0, 0.0, 1.0, 1.0])]
+
+
+class FakeTensor:
+    def __init__(self, values):
+        self.values = values
+
+    def tolist(self):
+        return list(self.values)
+
+
+class FakeResult:
+    names = {0: 'eczema', 1: 'melanoma'}
+
+    def __init__(self, *boxes):
+        self.boxes = list(boxes)
+
+
+def stub_model(*boxes):
+    """A callable standing in for YOLO that returns fixed detections"""
+    return lambda image_path: [FakeResult(*boxes)]
+
+
+@pytest.fixture
+def image(tmp_path):
+    path = tmp_path / 'image.jpg'
+    path.write_bytes(b'original')
+    return str(path)
+
+
+def make_evaluator(shadow_model, sample_rate=1.0):
+    evaluator = ShadowEvaluator('v1', 'candidate.pt', 'v2', sample_rate)
+    evaluator._shadow_model = shadow_model
+    return evaluator
+
+
+def run_shadow(evaluator, image, primary_predictions):
+    assert evaluator.maybe_submit(image, primary_predictions)
+    evaluator._executor.shutdown(wait=True)
+    return evaluator.get_stats()
+
+
+def versions_by_role(stats):
+    return {version['role']: version for version in stats['versions']}
+
+
+@pytest.mark.parametrize('rate, expected', [
+    (float('nan'), 0.0),
+    (float('inf'), 0.0),
+    (-0.5, 0.0),
+    (0.25, 0.25),
+    (3.0, 1.0),
+])
+def test_sample_rate_bounds(rate, expected):
+    evaluator = ShadowEvaluator('v1', 'candidate.pt', 'v2', rate)
+    assert evaluator.sample_rate == expected
+    assert evaluator.enabled == (expected > 0)
+
+
+def test_disabled_without_shadow_model(image):
+    evaluator = ShadowEvaluator('v1', None, None, 1.0)
+    assert not evaluator.enabled
+    assert not evaluator.maybe_submit(image, [])
+
+
+@pytest.mark.parametrize('value', ['nan', 'inf', 'not-a-number'])
+def test_create_rejects_invalid_sample_rate(monkeypatch, tmp_path, value):
+    model_path = tmp_path / 'candidate.pt'
+    model_path.write_bytes(b'')
+    monkeypatch.setenv('SHADOW_MODEL_PATH', str(model_path))
+    monkeypatch.setenv('SHADOW_SAMPLE_RATE', value)
+    evaluator = create_shadow_evaluator()
+    assert evaluator.sample_rate == 0.0
+    assert not evaluator.enabled
+
+
+def test_matching_version_labels_keep_both_roles(image):
+    evaluator = ShadowEvaluator('same', 'candidate.pt', 'same', 1.0)
+    evaluator._shadow_model = stub_model(FakeBox(1, 0.9))
+    evaluator.run_primary(stub_model(FakeBox(1, 0.8)), image)
+    stats = versions_by_role(run_shadow(evaluator, image, [{'class': 'melanoma', 'confidence': 0.8}]))
+
+    assert stats['primary']['version'] == 'same'
+    assert stats['primary']['inferences'] == 1
+    assert stats['shadow']['version'] == 'same'
+    assert stats['shadow']['inferences'] == 1
+
+
+def test_agreement_counts():
+    stats = VersionStats('v2', 'shadow')
+    stats.record_agreement('melanoma', 'melanoma')
+    stats.record_agreement('eczema', 'melanoma')
+    stats.record_agreement(None, 'melanoma')
+    stats.record_agreement(None, None)
+
+    agreement = stats.to_dict()['agreement']
+    assert agreement == {'compared': 3, 'agreed': 1, 'both_empty': 1, 'rate': pytest.approx(1 / 3)}
+
+
+def test_agreement_uses_most_confident_class(image):
+    evaluator = make_evaluator(stub_model(FakeBox(0, 0.3), FakeBox(1, 0.9)))
+    primary = [{'class': 'eczema', 'confidence': 0.2}, {'class': 'melanoma', 'confidence': 0.7}]
+    agreement = versions_by_role(run_shadow(evaluator, image, primary))['shadow']['agreement']
+    assert agreement['agreed'] == 1
+    assert agreement['rate'] == 1.0
+
+
+def test_latency_summary():
+    stats = VersionStats('v1', 'primary')
+    for latency in [40, 10, 30, 20]:
+        stats.record(latency)
+
+    latency_ms = stats.to_dict()['latency_ms']
+    assert latency_ms == {'mean': 20, 'p50': 20, 'p95': 30, 'max': 30, 'window': 3}
+    assert 'agreement' not in stats.to_dict()
+
+
+def test_warmup_call_kept_out_of_steady_state():
+    stats = VersionStats('v2', 'shadow')
+    stats.record(900, 400.0)
+    for memory_delta_mb in [4.0, 2.0, None, 6.0]:
+        stats.record(10, memory_delta_mb)
+
+    result = stats.to_dict()
+    assert result['inferences'] == 5
+    assert result['warmup'] == {'latency_ms': 900, 'memory_delta_mb': 400.0}
+    assert result['latency_ms']['max'] == 10
+    assert result['memory_delta_mb'] == {'mean': 4.0, 'p50': 4.0, 'p95': 6.0, 'max': 6.0, 'window': 3}
+
+
+def test_empty_stats():
+    stats = VersionStats('v2', 'shadow').to_dict()
+    assert stats['latency_ms']['mean'] is None
+    assert stats['latency_ms']['p95'] is None
+    assert stats['memory_delta_mb']['max'] is None
+    assert stats['memory_delta_mb']['window'] == 0
+    assert stats['warmup'] == {'latency_ms': None, 'memory_delta_mb': None}
+    assert stats['agreement']['rate'] is None
+
+
+def test_pending_cap_counts_skipped(image):
+    release = threading.Event()
+
+    def blocking_model(image_path):
+        release.wait(5)
+        return []
+
+    evaluator = make_evaluator(blocking_model)
+    try:
+        submitted = [evaluator.maybe_submit(image, []) for _ in range(MAX_PENDING_JOBS + 3)]
+        assert submitted.count(True) == MAX_PENDING_JOBS
+        assert evaluator.skipped == 3
+        assert evaluator.get_stats()['pending'] == MAX_PENDING_JOBS
+    finally:
+        release.set()
+        evaluator._executor.shutdown(wait=True)
+    assert evaluator.get_stats()['pending'] == 0
+
+
+def test_shadow_scores_private_copy(image):
+    seen = []
+    release = threading.Event()
+
+    def reading_model(image_path):
+        release.wait(5)
+        with open(image_path, 'rb') as f:
+            seen.append((image_path, f.read()))
+        return []
+
+    evaluator = make_evaluator(reading_model)
+    assert evaluator.maybe_submit(image, [])
+    # A later upload with the same filename overwrites the original
+    with open(image, 'wb') as f:
+        f.write(b'overwritten')
+    release.set()
+    evaluator._executor.shutdown(wait=True)
+
+    shadow_path, content = seen[0]
+    assert content == b'original'
+    assert shadow_path != image
+    assert not os.path.exists(shadow_path)
+
+
+def test_shadow_error_is_counted(image):
+    before = set(glob.glob(os.path.join(tempfile.gettempdir(), 'shadow_*')))
+
+    def failing_model(image_path):
+        raise RuntimeError('boom')
+
+    stats = run_shadow(make_evaluator(failing_model), image, [])
+    shadow = versions_by_role(stats)['shadow']
+    assert shadow['errors'] == 1
+    assert shadow['inferences'] == 0
+    assert stats['pending'] == 0
+    assert set(glob.glob(os.path.join(tempfile.gettempdir(), 'shadow_*'))) == before
+
+
+def test_primary_error_is_counted_and_raised(image):
+    def failing_model(image_path):
+        raise RuntimeError('boom')
+
+    evaluator = make_evaluator(stub_model())
+    with pytest.raises(RuntimeError):
+        evaluator.run_primary(failing_model, image)
+    primary = versions_by_role(evaluator.get_stats())['primary']
+    assert primary['errors'] == 1
+    assert primary['inferences'] == 0
+
+
+def test_memory_probe_reports_growth():
+    if shadow_eval.memory_method() != 'rss_peak_delta':
+        pytest.skip('peak RSS reset not available on this host')
+
+    with MemoryProbe() as probe:
+        buffer = bytearray(32 * 1024 * 1024)
+        buffer[::4096] = b'\1' * len(buffer[::4096])
+        del buffer
+    # Freed before the call ends, but the peak is still captured
+    assert probe.delta_mb >= 24
+
+
+def test_memory_probe_skips_when_peak_counter_busy():
+    if shadow_eval.memory_method() not in ('cuda_peak_delta', 'rss_peak_delta'):
+        pytest.skip('no process-wide peak counter on this host')
+
+    with shadow_eval._peak_lock:
+        with MemoryProbe(blocking=False) as probe:
+            pass
+    assert probe.delta_mb is None
+    assert not shadow_eval._peak_lock.locked()
+
+
+def test_shadow_latency_excludes_memory_lock_wait(image):
+    if shadow_eval.memory_method() not in ('cuda_peak_delta', 'rss_peak_delta'):
+        pytest.skip('no process-wide peak counter on this host')
+
+    primary_started = threading.Event()
+
+    def slow_primary(image_path):
+        primary_started.set()
+        time.sleep(0.5)
+        return []
+
+    evaluator = make_evaluator(stub_model())
+    primary = threading.Thread(target=evaluator.run_primary, args=(slow_primary, image))
+    primary.start()
+    # The shadow job queues behind the primary call holding the peak counter
+    primary_started.wait(5)
+    stats = versions_by_role(run_shadow(evaluator, image, []))
+    primary.join()
+
+    # The single shadow call is its warm-up sample
+    assert stats['shadow']['inferences'] == 1
+    assert stats['shadow']['warmup']['memory_delta_mb'] is not None
+    assert stats['shadow']['warmup']['latency_ms'] < 100
+
+
+def test_default_labels_hide_server_paths(monkeypatch, tmp_path):
+    model_path = tmp_path / 'models' / 'candidate.pt'
+    model_path.parent.mkdir()
+    model_path.write_bytes(b'')
+    monkeypatch.setenv('SHADOW_MODEL_PATH', str(model_path))
+    monkeypatch.delenv('MODEL_VERSION', raising=False)
+    monkeypatch.delenv('SHADOW_MODEL_VERSION', raising=False)
+
+    labels = [version['version'] for version in create_shadow_evaluator().get_stats()['versions']]
+    assert labels == ['best.pt', 'candidate.pt']
+
+
+def test_submit_after_shutdown_is_skipped(image):
+    before = set(glob.glob(os.path.join(tempfile.gettempdir(), 'shadow_*')))
+    evaluator = make_evaluator(stub_model())
+    evaluator._executor.shutdown(wait=True)
+
+    assert not evaluator.maybe_submit(image, [])
+    stats = evaluator.get_stats()
+    assert stats['pending'] == 0
+    assert stats['skipped'] == 1
+    assert set(glob.glob(os.path.join(tempfile.gettempdir(), 'shadow_*'))) == before
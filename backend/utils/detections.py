@@ -0,0 +1,15 @@
+# Default weights served by /api/predict
+PRIMARY_MODEL_PATH = 'ml_model/best.pt'
+
+
+def parse_results(results):
+    """Convert YOLO results into the prediction dicts returned by the API"""
+    predictions = []
+    for result in results:
+        for box in result.boxes:
+            predictions.append({
+                'class': result.names[int(box.cls[0])],
+                'confidence': float(box.conf[0]),
+                'bbox': box.xyxy[0].tolist()
+            })
+    return predictions
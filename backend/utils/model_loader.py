@@ -6,9 +6,10 @@ from PIL import Image
 import matplotlib
 matplotlib.use('Agg')  # Use non-interactive backend
 import matplotlib.pyplot as plt
+from utils.detections import PRIMARY_MODEL_PATH
 
 class SkinDiseaseDetector:
-    def __init__(self, model_path='ml_model/best.pt'):
+    def __init__(self, model_path=PRIMARY_MODEL_PATH):
         """Initialize YOLOv8 model"""
         if not os.path.exists(model_path):
             raise FileNotFoundError(f"Model file not found at {model_path}")
@@ -0,0 +1,372 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import math
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import traceback
+from utils.detections import PRIMARY_MODEL_PATH, parse_results
+
+# Shadow evaluation is configured through environment variables so a
+# candidate model can be trialled without code changes:
+#   SHADOW_MODEL_PATH    - candidate weights (shadow mode is off when unset)
+#   SHADOW_SAMPLE_RATE   - fraction of uploads mirrored to the candidate (0.0 - 1.0)
+#   SHADOW_MODEL_VERSION - label for the candidate in stats (defaults to the file name)
+#   MODEL_VERSION        - label for the primary model in stats (defaults to the file name)
+MAX_PENDING_JOBS = 32
+LATENCY_WINDOW = 1000
+
+
+def top_class(predictions):
+    """Return the class name of the most confident detection, or None"""
+    if not predictions:
+        return None
+    return max(predictions, key=lambda pred: pred['confidence'])['class']
+
+
+MB = 1024 * 1024
+
+
+def _summarize(values):
+    """Mean and nearest-rank p50/p95/max of a sample window"""
+    values = sorted(values)
+
+    def percentile(p):
+        if not values:
+            return None
+        return values[min(len(values) - 1, int(p * len(values)))]
+
+    return {
+        'mean': sum(values) / len(values) if values else None,
+        'p50': percentile(0.50),
+        'p95': percentile(0.95),
+        'max': values[-1] if values else None,
+        'window': len(values)
+    }
+
+
+def _cuda_available():
+    try:
+        import torch
+    except ImportError:
+        return False
+    return torch.cuda.is_available()
+
+
+def _proc_status_bytes(field):
+    """Read a kB field such as VmRSS/VmHWM from /proc/self/status, or None"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _reset_rss_peak():
+    """Reset VmHWM to the current RSS (Linux 4.0+); False if not permitted"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+_memory_method = None
+
+
+def memory_method():
+    """
+    How MemoryProbe measures memory on this host
+
+    cuda_peak_delta - CUDA allocator peak during the call minus allocation at its start
+    rss_peak_delta  - process peak RSS (VmHWM, reset per call) minus RSS at its start
+    rss_delta       - RSS after the call minus before; misses memory freed within the call
+    unavailable     - nothing is measured
+    """
+    global _memory_method
+    if _memory_method is None:
+        if _cuda_available():
+            _memory_method = 'cuda_peak_delta'
+        elif _proc_status_bytes('VmHWM') is not None and _reset_rss_peak():
+            _memory_method = 'rss_peak_delta'
+        elif _proc_status_bytes('VmRSS') is not None:
+            _memory_method = 'rss_delta'
+        else:
+            _memory_method = 'unavailable'
+    return _memory_method
+
+
+# The CUDA and VmHWM peak counters are process-wide. Only the holder of this
+# lock may reset and read them, so primary and shadow can't wipe each other's peak.
+_peak_lock = threading.Lock()
+
+
+class MemoryProbe:
+    """
+    Measure memory growth across one inference call (see memory_method)
+
+    With blocking=False the call is left unmeasured (delta_mb stays None) when
+    another call holds the peak counter. Peaks are process-wide, so concurrent
+    unmeasured requests in the same process can still inflate a reading.
+    """
+
+    def __init__(self, blocking=True):
+        self.blocking = blocking
+        self.delta_mb = None
+        self._method = memory_method()
+        self._locked = False
+        self._before = None
+
+    def __enter__(self):
+        if self._method in ('cuda_peak_delta', 'rss_peak_delta'):
+            self._locked = _peak_lock.acquire(blocking=self.blocking)
+            if not self._locked:
+                return self
+            if self._method == 'cuda_peak_delta':
+                import torch
+                self._before = torch.cuda.memory_allocated()
+                torch.cuda.reset_peak_memory_stats()
+            else:
+                self._before = _proc_status_bytes('VmRSS')
+                _reset_rss_peak()
+        elif self._method == 'rss_delta':
+            self._before = _proc_status_bytes('VmRSS')
+        return self
+
+    def __exit__(self, *exc_info):
+        try:
+            if self._before is None:
+                return False
+            if self._method == 'cuda_peak_delta':
+                import torch
+                after = torch.cuda.max_memory_allocated()
+            elif self._method == 'rss_peak_delta':
+                after = _proc_status_bytes('VmHWM')
+            else:
+                after = _proc_status_bytes('VmRSS')
+            if after is not None:
+                self.delta_mb = max(0, after - self._before) / MB
+        finally:
+            if self._locked:
+                _peak_lock.release()
+        return False
+
+
+class VersionStats:
+    """Running inference stats for a single model version"""
+
+    def __init__(self, version, role):
+        self.version = version
+        self.role = role
+        self.count = 0
+        self.errors = 0
+        self.warmup_latency_ms = None
+        self.warmup_memory_delta_mb = None
+        self.latencies_ms = deque(maxlen=LATENCY_WINDOW)
+        self.memory_deltas_mb = deque(maxlen=LATENCY_WINDOW)
+        self.compared = 0
+        self.agreed = 0
+        self.both_empty = 0
+
+    def record(self, latency_ms, memory_delta_mb=None):
+        self.count += 1
+        if self.count == 1:
+            # The first call builds the predictor and moves/fuses the model on the
+            # device; keep that one-time cost out of the steady-state figures.
+            self.warmup_latency_ms = latency_ms
+            self.warmup_memory_delta_mb = memory_delta_mb
+            return
+        self.latencies_ms.append(latency_ms)
+        if memory_delta_mb is not None:
+            self.memory_deltas_mb.append(memory_delta_mb)
+
+    def record_agreement(self, shadow_top_class, primary_top_class):
+        # Neither model detecting anything says nothing about which class wins,
+        # so those samples are counted separately and kept out of the rate.
+        if shadow_top_class is None and primary_top_class is None:
+            self.both_empty += 1
+            return
+        self.compared += 1
+        if shadow_top_class == primary_top_class:
+            self.agreed += 1
+
+    def to_dict(self):
+        stats = {
+            'version': self.version,
+            'role': self.role,
+            'inferences': self.count,
+            'errors': self.errors,
+            'warmup': {
+                'latency_ms': self.warmup_latency_ms,
+                'memory_delta_mb': self.warmup_memory_delta_mb
+            },
+            'latency_ms': _summarize(self.latencies_ms),
+            'memory_delta_mb': _summarize(self.memory_deltas_mb)
+        }
+        if self.role == 'shadow':
+            stats['agreement'] = {
+                'compared': self.compared,
+                'agreed': self.agreed,
+                'both_empty': self.both_empty,
+                'rate': self.agreed / self.compared if self.compared else None
+            }
+        return stats
+
+
+class ShadowEvaluator:
+    def __init__(self, primary_version, shadow_model_path=None, shadow_version=None,
+                 sample_rate=0.0):
+        """Mirror a fraction of traffic to a candidate model in the background"""
+        self.primary_version = primary_version
+        self.shadow_model_path = shadow_model_path
+        self.shadow_version = shadow_version or (os.path.basename(shadow_model_path) if shadow_model_path else None)
+        # NaN would survive min/max clamping as 1.0 and mirror every request
+        self.sample_rate = max(0.0, min(1.0, sample_rate)) if math.isfinite(sample_rate) else 0.0
+        self.enabled = bool(shadow_model_path) and self.sample_rate > 0
+        self.skipped = 0
+
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._shadow_model = None
+        # Keyed by role so identical version labels can't collide
+        self._stats = {'primary': VersionStats(primary_version, 'primary')}
+        self._executor = None
+
+        if self.enabled:
+            self._stats['shadow'] = VersionStats(self.shadow_version, 'shadow')
+            # A single worker keeps the candidate from competing with itself for CPU/GPU
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='shadow')
+
+    def run_primary(self, model, image_path):
+        """Run the primary model, recording its latency and memory"""
+        # Never wait on the shadow worker for the memory lock; skip the sample instead
+        probe = MemoryProbe(blocking=False)
+        try:
+            # Time only the model call, not the probe's lock and /proc bookkeeping
+            with probe:
+                start = time.perf_counter()
+                results = model(image_path)
+                latency_ms = (time.perf_counter() - start) * 1000
+        except Exception:
+            with self._lock:
+                self._stats['primary'].errors += 1
+            raise
+        with self._lock:
+            self._stats['primary'].record(latency_ms, probe.delta_mb)
+        return results
+
+    def maybe_submit(self, image_path, primary_predictions):
+        """Queue a shadow inference for a sampled request without blocking it"""
+        if not self.enabled or random.random() >= self.sample_rate:
+            return False
+
+        with self._lock:
+            # Drop samples rather than let a slow candidate build an unbounded backlog
+            if self._pending >= MAX_PENDING_JOBS:
+                self.skipped += 1
+                return False
+            self._pending += 1
+
+        # Uploads are saved under their original filename, so a later upload can
+        # overwrite the file before the worker reads it. Score a private copy.
+        try:
+            fd, shadow_path = tempfile.mkstemp(prefix='shadow_', suffix=os.path.splitext(image_path)[1])
+            os.close(fd)
+            shutil.copyfile(image_path, shadow_path)
+        except OSError:
+            print(f"Shadow copy error: {traceback.format_exc()}")
+            with self._lock:
+                self._pending -= 1
+                self.skipped += 1
+            return False
+
+        try:
+            self._executor.submit(self._run_shadow, shadow_path, top_class(primary_predictions))
+        except RuntimeError:
+            # Executor or interpreter shutting down; the primary result still stands
+            print(f"Shadow submit error: {traceback.format_exc()}")
+            try:
+                os.remove(shadow_path)
+            except OSError:
+                pass
+            with self._lock:
+                self._pending -= 1
+                self.skipped += 1
+            return False
+        return True
+
+    def _load_shadow_model(self):
+        if self._shadow_model is None:
+            from ultralytics import YOLO
+            self._shadow_model = YOLO(self.shadow_model_path)
+        return self._shadow_model
+
+    def _run_shadow(self, image_path, primary_top_class):
+        stats = self._stats['shadow']
+        try:
+            model = self._load_shadow_model()
+            probe = MemoryProbe(blocking=True)
+            # The probe may wait for a live request to release the peak counter;
+            # start the clock once it is held so the wait isn't charged to the candidate.
+            with probe:
+                start = time.perf_counter()
+                results = model(image_path)
+                latency_ms = (time.perf_counter() - start) * 1000
+            shadow_top_class = top_class(parse_results(results))
+
+            with self._lock:
+                stats.record(latency_ms, probe.delta_mb)
+                stats.record_agreement(shadow_top_class, primary_top_class)
+        except Exception:
+            print(f"Shadow inference error: {traceback.format_exc()}")
+            with self._lock:
+                stats.errors += 1
+        finally:
+            try:
+                os.remove(image_path)
+            except OSError:
+                pass
+            with self._lock:
+                self._pending -= 1
+
+    def get_stats(self):
+        """Snapshot of per-version stats for promotion decisions"""
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'sample_rate': self.sample_rate,
+                'pending': self._pending,
+                'skipped': self.skipped,
+                'memory_method': memory_method(),
+                'versions': [stats.to_dict() for stats in self._stats.values()]
+            }
+
+
+def create_shadow_evaluator():
+    """Build a ShadowEvaluator from environment configuration"""
+    shadow_model_path = os.environ.get('SHADOW_MODEL_PATH')
+    if shadow_model_path and not os.path.exists(shadow_model_path):
+        print(f"⚠️ WARNING: shadow model not found at {shadow_model_path}, shadow mode disabled")
+        shadow_model_path = None
+
+    try:
+        sample_rate = float(os.environ.get('SHADOW_SAMPLE_RATE', '0.1'))
+        if not math.isfinite(sample_rate):
+            raise ValueError(f"non-finite sample rate {sample_rate}")
+    except ValueError:
+        print("⚠️ WARNING: invalid SHADOW_SAMPLE_RATE, shadow mode disabled")
+        sample_rate = 0.0
+
+    return ShadowEvaluator(
+        primary_version=os.environ.get('MODEL_VERSION', os.path.basename(PRIMARY_MODEL_PATH)),
+        shadow_model_path=shadow_model_path,
+        shadow_version=os.environ.get('SHADOW_MODEL_VERSION'),
+        sample_rate=sample_rate
+    )